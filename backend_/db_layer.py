@@ -1,286 +1,539 @@
-import os
-import json
-import uuid
-from contextlib import contextmanager
-from typing import Optional
-from google.cloud.sql.connector import Connector
-import pg8000
-
-class DBLayer:
-    def __init__(self):
-        self._connector = Connector()
-        self._instance = f"{os.getenv('GCP_PROJECT_ID')}:{os.getenv('GCP_LOCATION','us-central1')}:{os.getenv('GCP_DB_INSTANCE')}"
-        self._db = os.getenv('GCP_DB_NAME')
-        self._user = os.getenv('GCP_DB_USER')
-        self._password = os.getenv('GCP_DB_PASSWORD')
-
-    def _get_conn(self):
-        return self._connector.connect(
-            self._instance,
-            "pg8000",
-            user=self._user,
-            password=self._password,
-            db=self._db,
-        )
-
-    @contextmanager
-    def transaction(self):
-        conn = self._get_conn()
-        try:
-            yield conn
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
-
-    def insert_product(self, conn, product_name: str, product_category: str, price: float, admin_id: str, admin_type: str):
-        try:
-            # Ensure a product_type exists or create a placeholder by name
-            # Try find by name
-            cur = conn.cursor()
-            cur.execute("SELECT product_type_id FROM product_types WHERE type_name=%s", (product_category,))
-            row = cur.fetchone()
-            if row:
-                product_type_id = row[0]
-            else:
-                cur.execute("INSERT INTO product_types (type_name, description) VALUES (%s,%s) RETURNING product_type_id", (product_category, None))
-                product_type_id = cur.fetchone()[0]
-            # Insert product
-            try:
-                admin_uuid = uuid.UUID(admin_id)
-            except ValueError:
-                # If not a valid UUID, create one from the string
-                admin_uuid = uuid.uuid5(uuid.NAMESPACE_DNS, admin_id)
-            
-            cur.execute(
-                """
-                INSERT INTO products (product_name, product_type_id, product_type_name, created_by_admin_id, admin_type, price)
-                VALUES (%s,%s,%s,%s,%s,%s) RETURNING product_id
-                """,
-                (product_name, product_type_id, product_category, admin_uuid, admin_type, price)
-            )
-            return cur.fetchone()[0]
-        except Exception as e:
-            print(f"Database error in insert_product: {e}")
-            raise
-
-    def insert_ai_train_product(self, conn, product_id, product_name: str, product_category: str, suggestion_questions, product_vector_id: Optional[str], number_of_videos: int):
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO ai_train_products (product_id, product_name, product_category, product_vector_id, number_of_videos, suggestion_questions)
-            VALUES (%s,%s,%s,%s,%s,%s)
-            """,
-            (product_id, product_name, product_category, product_vector_id, number_of_videos, json.dumps(suggestion_questions) if isinstance(suggestion_questions, (dict, list)) else suggestion_questions)
-        )
-
-    def update_ai_train_product(self, conn, product_id, product_vector_id: str, number_of_videos: int):
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE ai_train_products SET product_vector_id=%s, number_of_videos=%s, updated_at=NOW() WHERE product_id=%s",
-            (product_vector_id, number_of_videos, product_id)
-        )
-
-    def insert_ai_train_product_detail(self, conn, product_id, video_path: str, audio_path: str, text_path: str, pdf_path: str, lesson_title: str, lesson_order: int, metadata):
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO ai_train_product_details (product_id, video_path, audio_path, text_path, pdf_path, lesson_title, lesson_order, metadata)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-            """,
-            (product_id, video_path, audio_path, text_path, pdf_path, lesson_title, lesson_order, json.dumps(metadata) if isinstance(metadata, (dict, list)) else metadata)
-        )
-
-    def insert_vector_metadata(self, conn, product_id, vector_index_name: str, content_type: str, source_file_path: str, metadata):
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO vector_metadata (product_id, vector_index_name, content_type, source_file_path, metadata)
-            VALUES (%s,%s,%s,%s,%s)
-            """,
-            (product_id, vector_index_name, content_type, source_file_path, json.dumps(metadata) if isinstance(metadata, (dict, list)) else metadata)
-        )
-
-    def get_product_vectors(self, conn, product_ids: list):
-        """Get vector metadata for specific product IDs"""
-        cur = conn.cursor()
-        placeholders = ','.join(['%s'] * len(product_ids))
-        cur.execute(
-            f"""
-            SELECT vm.product_id, vm.vector_index_name, vm.content_type, vm.source_file_path, vm.metadata,
-                   atp.product_name, atp.product_category
-            FROM vector_metadata vm
-            JOIN ai_train_products atp ON vm.product_id = atp.product_id
-            WHERE vm.product_id IN ({placeholders})
-            ORDER BY vm.product_id, vm.created_at
-            """,
-            product_ids
-        )
-        return cur.fetchall()
-
-    def get_all_products(self, conn):
-        """Get all AI training products"""
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT product_id, product_name, product_category, number_of_videos, 
-                   product_vector_id, suggestion_questions, created_at
-            FROM ai_train_products
-            ORDER BY created_at DESC
-            """
-        )
-        return cur.fetchall()
-
-    # Digital Products methods
-    def insert_digital_product(self, conn, product_id, product_name: str, product_category: str, 
-                               product_location: str, product_size_mb: float, file_format: str, 
-                               description: str = None):
-        """Insert digital product details"""
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO digital_products (product_id, product_name, product_category, 
-                                         product_location, product_size_mb, file_format)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            (product_id, product_name, product_category, product_location, product_size_mb, file_format)
-        )
-
-    def get_all_digital_products(self, conn):
-        """Get all digital products"""
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT dp.product_id, dp.product_name, dp.product_category, dp.product_location,
-                   dp.product_size_mb, dp.file_format, dp.created_at, p.price
-            FROM digital_products dp
-            JOIN products p ON dp.product_id = p.product_id
-            ORDER BY dp.created_at DESC
-            """
-        )
-        return cur.fetchall()
-
-    def get_digital_product_by_id(self, conn, product_id):
-        """Get digital product by ID"""
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT dp.product_id, dp.product_name, dp.product_category, dp.product_location,
-                   dp.product_size_mb, dp.file_format, dp.created_at, p.price
-            FROM digital_products dp
-            JOIN products p ON dp.product_id = p.product_id
-            WHERE dp.product_id = %s
-            """,
-            (product_id,)
-        )
-        return cur.fetchone()
-
-    # Authentication methods
-    def get_super_admin_by_credentials(self, conn, email: str, password: str):
-        """Get super admin by email and password"""
-        cur = conn.cursor()
-        cur.execute("SELECT admin_id, name FROM SUPER_ADMINS WHERE email = %s AND password = %s", 
-                   (email, password))
-        return cur.fetchone()
-
-    def get_sub_admin_by_credentials(self, conn, email: str, password: str):
-        """Get sub admin by email and password"""
-        cur = conn.cursor()
-        cur.execute("SELECT sub_admin_id, name FROM SUB_ADMINS WHERE email = %s AND password = %s", 
-                   (email, password))
-        return cur.fetchone()
-
-    def is_super_admin(self, conn, user_id: str):
-        """Check if user is super admin"""
-        cur = conn.cursor()
-        cur.execute("SELECT admin_id FROM SUPER_ADMINS WHERE admin_id = %s", (user_id,))
-        return cur.fetchone() is not None
-
-    def is_sub_admin(self, conn, user_id: str):
-        """Check if user is sub admin"""
-        cur = conn.cursor()
-        cur.execute("SELECT sub_admin_id FROM SUB_ADMINS WHERE sub_admin_id = %s", (user_id,))
-        return cur.fetchone() is not None
-
-    def insert_super_admin(self, conn, name: str, email: str, password: str, phone: str = None):
-        """Insert super admin"""
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO SUPER_ADMINS (name, email, password, phone)
-            VALUES (%s, %s, %s, %s)
-            RETURNING admin_id
-        """, (name, email, password, phone))
-        return cur.fetchone()[0]
-
-    def insert_sub_admin(self, conn, name: str, created_by: str, email: str, phone_number: str, password: str):
-        """Insert sub admin"""
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO SUB_ADMINS (name, created_by_super_admin_id, email, phone_number, password)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING sub_admin_id
-        """, (name, created_by, email, phone_number, password))
-        return cur.fetchone()[0]
-
-    def get_table_data(self, conn, table_name: str):
-        """Get all data from a table"""
-        cur = conn.cursor()
-        cur.execute(f"SELECT * FROM {table_name}")
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        data = [dict(zip(columns, row)) for row in rows]
-        return data
-
-    def get_super_admin_by_credentials(self, conn, email: str, password: str):
-        """Get super admin by email and password"""
-        cur = conn.cursor()
-        cur.execute("SELECT admin_id, name FROM SUPER_ADMINS WHERE email = %s AND password = %s", (email, password))
-        return cur.fetchone()
-
-    def get_sub_admin_by_credentials(self, conn, email: str, password: str):
-        """Get sub admin by email and password"""
-        cur = conn.cursor()
-        cur.execute("SELECT sub_admin_id, name FROM SUB_ADMINS WHERE email = %s AND password = %s", (email, password))
-        return cur.fetchone()
-
-    def is_super_admin(self, conn, admin_id: str):
-        """Check if user is super admin"""
-        cur = conn.cursor()
-        cur.execute("SELECT admin_id FROM SUPER_ADMINS WHERE admin_id = %s", (admin_id,))
-        return cur.fetchone() is not None
-
-    def is_sub_admin(self, conn, admin_id: str):
-        """Check if user is sub admin"""
-        cur = conn.cursor()
-        cur.execute("SELECT sub_admin_id FROM SUB_ADMINS WHERE sub_admin_id = %s", (admin_id,))
-        return cur.fetchone() is not None
-
-    def insert_super_admin(self, conn, name: str, email: str, password: str, phone: str = None):
-        """Insert new super admin"""
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO SUPER_ADMINS (name, email, password, phone)
-            VALUES (%s, %s, %s, %s)
-            RETURNING admin_id
-        """, (name, email, password, phone))
-        return cur.fetchone()[0]
-
-    def insert_sub_admin(self, conn, name: str, created_by_super_admin_id: str, email: str, phone_number: str, password: str):
-        """Insert new sub admin"""
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO SUB_ADMINS (name, created_by_super_admin_id, email, phone_number, password)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING sub_admin_id
-        """, (name, created_by_super_admin_id, email, phone_number, password))
-        return cur.fetchone()[0]
-
-    def get_table_data(self, conn, table_name: str):
-        """Get all data from specified table"""
-        cur = conn.cursor()
-        cur.execute(f"SELECT * FROM {table_name}")
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+import os
+import contextvars
+import csv
+import functools
+import io
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional
+from cachetools import TTLCache
+from google.cloud.sql.connector import Connector
+from sqlalchemy import create_engine
+import pg8000
+
+from row_prep import json_value as _json, prepare_detail_rows, prepare_vector_rows
+
+log = logging.getLogger("db_layer")
+
+# Hot-path SQL lives in module-level constants so every call sends Postgres
+# byte-identical statement text. pg8000's DB-API exposes no prepare(), so plan
+# reuse comes from keeping the text invariant (server statement cache,
+# pg_stat_statements) rather than named statements; the IN-list query uses
+# ANY(%s) with one array parameter so its text doesn't vary with list length.
+_INSERT_AI_TRAIN_PRODUCT_SQL = """
+    INSERT INTO ai_train_products (product_id, product_name, product_category, product_vector_id, number_of_videos, suggestion_questions)
+    VALUES (%s,%s,%s,%s,%s,%s)
+"""
+
+_INSERT_AI_TRAIN_PRODUCT_DETAIL_SQL = """
+    INSERT INTO ai_train_product_details (product_id, video_path, audio_path, text_path, pdf_path, lesson_title, lesson_order, metadata)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+_INSERT_VECTOR_METADATA_SQL = """
+    INSERT INTO vector_metadata (product_id, vector_index_name, content_type, source_file_path, metadata)
+    VALUES (%s,%s,%s,%s,%s)
+"""
+
+# Tables get_table_data may interpolate into SELECT * FROM; the table name
+# can't be a bind parameter, so it is validated here regardless of caller
+_ALLOWED_TABLE_NAMES = frozenset({
+    'super_admins', 'sub_admins', 'users', 'product_types', 'products',
+    'digital_products', 'ai_train_products', 'ai_train_product_details',
+    'payments', 'user_purchases', 'user_activity_log', 'sub_admin_activity_log',
+    'super_admin_activity_log', 'chat_sessions', 'vector_metadata'
+})
+
+# Writable CTE: type upsert -> products insert -> ai_train_products insert in
+# one round-trip, instead of three statements on the ingest path
+_CREATE_AI_PRODUCT_SQL = """
+    WITH t AS (
+        INSERT INTO product_types (type_name, description) VALUES (%s, NULL)
+        ON CONFLICT (type_name) DO UPDATE SET type_name = EXCLUDED.type_name
+        RETURNING product_type_id
+    ), p AS (
+        INSERT INTO products (product_id, product_name, product_type_id, product_type_name, created_by_admin_id, admin_type, price)
+        SELECT %s, %s, t.product_type_id, %s, %s, %s, %s FROM t
+        RETURNING product_id
+    )
+    INSERT INTO ai_train_products (product_id, product_name, product_category, product_vector_id, number_of_videos, suggestion_questions)
+    SELECT p.product_id, %s, %s, %s, %s, %s FROM p
+    RETURNING product_id
+"""
+
+_GET_PRODUCT_VECTORS_SQL = """
+    SELECT vm.product_id, vm.vector_index_name, vm.content_type, vm.source_file_path, vm.metadata,
+           atp.product_name, atp.product_category
+    FROM vector_metadata vm
+    JOIN ai_train_products atp ON vm.product_id = atp.product_id
+    WHERE vm.product_id = ANY(%s)
+    ORDER BY vm.product_id, vm.created_at
+"""
+
+# Connection bound to the current request/task by transaction(); lets nested
+# transaction() blocks and @with_conn methods share one pool checkout
+_current_conn: contextvars.ContextVar = contextvars.ContextVar("db_conn", default=None)
+
+
+def with_conn(method):
+    """Fill in conn from the context-bound connection when not passed.
+
+    Methods keep their explicit conn parameter, but inside a transaction()
+    block callers may omit it (or pass None) and pick up the current one.
+    """
+    @functools.wraps(method)
+    def wrapper(self, conn=None, *args, **kwargs):
+        if conn is None:
+            conn = _current_conn.get()
+            if conn is None:
+                raise RuntimeError("No active transaction; call inside db.transaction()")
+        return method(self, conn, *args, **kwargs)
+    return wrapper
+
+
+@lru_cache(maxsize=2048)
+def _coerce_admin_uuid(admin_id: str) -> uuid.UUID:
+    """Parse an admin id as a UUID, deriving a stable uuid5 for non-UUID ids.
+
+    Admin ids repeat across requests, so the parse/derive cost is paid once
+    per distinct id.
+    """
+    try:
+        return uuid.UUID(admin_id)
+    except ValueError:
+        return uuid.uuid5(uuid.NAMESPACE_DNS, admin_id)
+
+
+class DBLayer:
+    def __init__(self):
+        self._connector = Connector()
+        self._instance = f"{os.getenv('GCP_PROJECT_ID')}:{os.getenv('GCP_LOCATION','us-central1')}:{os.getenv('GCP_DB_INSTANCE')}"
+        self._db = os.getenv('GCP_DB_NAME')
+        self._user = os.getenv('GCP_DB_USER')
+        self._password = os.getenv('GCP_DB_PASSWORD')
+        # Bounded connection pool over the Cloud SQL Connector. Idle connections
+        # are reused (pre-pinged and recycled every 30 min) so requests pay a
+        # checkout instead of TCP + TLS + IAM auth. Keep total pool size below
+        # Cloud SQL max_connections across all workers.
+        self._engine = create_engine(
+            "postgresql+pg8000://",
+            creator=self._connect,
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=5,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+        )
+        # product_types is tiny and append-only; cache resolved type ids so
+        # repeated product inserts skip the lookup round-trip
+        self._product_type_ids = {}
+        # admin id -> role, owned by the layer so admin inserts can invalidate
+        # entries instead of waiting out the TTL
+        self._role_cache = TTLCache(maxsize=4096, ttl=60)
+        self._role_lock = threading.Lock()
+
+    def _connect(self):
+        return self._connector.connect(
+            self._instance,
+            "pg8000",
+            user=self._user,
+            password=self._password,
+            db=self._db,
+        )
+
+    @contextmanager
+    def transaction(self):
+        existing = _current_conn.get()
+        if existing is not None:
+            # Nested use within the same request reuses the bound connection;
+            # the outermost transaction() owns commit/rollback
+            yield existing
+            return
+        conn = self._engine.raw_connection()
+        token = _current_conn.set(conn)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                _current_conn.reset(token)
+            except ValueError:
+                # FastAPI runs a sync generator dependency's enter and exit in
+                # separate copied Contexts, so the token can be foreign here;
+                # clear the binding instead of letting reset() raise.
+                _current_conn.set(None)
+            finally:
+                # Returns the connection to the pool
+                conn.close()
+
+    @with_conn
+    def insert_product(self, conn, product_name: str, product_category: str, price: float, admin_id: str, admin_type: str, product_id=None):
+        try:
+            cur = conn.cursor()
+            # Ensure a product_type exists or create a placeholder by name
+            product_type_id = self._product_type_ids.get(product_category)
+            if product_type_id is None:
+                # Single race-free upsert instead of SELECT-then-INSERT; the
+                # no-op DO UPDATE makes RETURNING yield the id on conflict too
+                cur.execute(
+                    """
+                    INSERT INTO product_types (type_name, description) VALUES (%s, %s)
+                    ON CONFLICT (type_name) DO UPDATE SET type_name = EXCLUDED.type_name
+                    RETURNING product_type_id
+                    """,
+                    (product_category, None)
+                )
+                product_type_id = cur.fetchone()[0]
+                self._product_type_ids[product_category] = product_type_id
+            # Insert product
+            admin_uuid = _coerce_admin_uuid(admin_id)
+
+            if product_id is not None:
+                # Caller-supplied id (allows tagging pipeline artifacts before the insert)
+                cur.execute(
+                    """
+                    INSERT INTO products (product_id, product_name, product_type_id, product_type_name, created_by_admin_id, admin_type, price)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s) RETURNING product_id
+                    """,
+                    (product_id, product_name, product_type_id, product_category, admin_uuid, admin_type, price)
+                )
+            else:
+                cur.execute(
+                    """
+                    INSERT INTO products (product_name, product_type_id, product_type_name, created_by_admin_id, admin_type, price)
+                    VALUES (%s,%s,%s,%s,%s,%s) RETURNING product_id
+                    """,
+                    (product_name, product_type_id, product_category, admin_uuid, admin_type, price)
+                )
+            return cur.fetchone()[0]
+        except Exception as e:
+            log.error(f"Database error in insert_product: {e}")
+            raise
+
+    @with_conn
+    def create_ai_product(self, conn, product_id, product_name: str, product_category: str, price: float,
+                          admin_id: str, admin_type: str, suggestion_questions,
+                          product_vector_id: Optional[str], number_of_videos: int):
+        """Create the products + ai_train_products rows in a single statement.
+
+        Fuses the product_types upsert and both inserts into one writable CTE,
+        so the ingest path pays one round-trip instead of three.
+        """
+        cur = conn.cursor()
+        cur.execute(
+            _CREATE_AI_PRODUCT_SQL,
+            (
+                product_category,
+                product_id, product_name, product_category, _coerce_admin_uuid(admin_id), admin_type, price,
+                product_name, product_category, product_vector_id, number_of_videos, _json(suggestion_questions),
+            )
+        )
+        return cur.fetchone()[0]
+
+    @with_conn
+    def insert_ai_train_product(self, conn, product_id, product_name: str, product_category: str, suggestion_questions, product_vector_id: Optional[str], number_of_videos: int):
+        cur = conn.cursor()
+        cur.execute(
+            _INSERT_AI_TRAIN_PRODUCT_SQL,
+            (product_id, product_name, product_category, product_vector_id, number_of_videos, _json(suggestion_questions))
+        )
+
+    @with_conn
+    def update_ai_train_product(self, conn, product_id, product_vector_id: str, number_of_videos: int):
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE ai_train_products SET product_vector_id=%s, number_of_videos=%s, updated_at=NOW() WHERE product_id=%s",
+            (product_vector_id, number_of_videos, product_id)
+        )
+
+    @with_conn
+    def insert_ai_train_product_detail(self, conn, product_id, video_path: str, audio_path: str, text_path: str, pdf_path: str, lesson_title: str, lesson_order: int, metadata):
+        cur = conn.cursor()
+        cur.execute(
+            _INSERT_AI_TRAIN_PRODUCT_DETAIL_SQL,
+            (product_id, video_path, audio_path, text_path, pdf_path, lesson_title, lesson_order, _json(metadata))
+        )
+
+    @with_conn
+    def insert_vector_metadata(self, conn, product_id, vector_index_name: str, content_type: str, source_file_path: str, metadata):
+        cur = conn.cursor()
+        cur.execute(
+            _INSERT_VECTOR_METADATA_SQL,
+            (product_id, vector_index_name, content_type, source_file_path, _json(metadata))
+        )
+
+    # Batches above this size go through COPY instead of executemany
+    COPY_THRESHOLD = 500
+
+    @staticmethod
+    def _copy_rows(conn, copy_sql: str, rows: list):
+        """Stream rows into a table via the COPY protocol (one round-trip)."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerows(rows)
+        buf.seek(0)
+        cur = conn.cursor()
+        cur.execute(copy_sql, stream=buf)
+
+    @with_conn
+    def insert_ai_train_product_details_batch(self, conn, rows: list):
+        """Insert many ai_train_product_details rows in a single round-trip.
+
+        Each row is (product_id, video_path, audio_path, text_path, pdf_path,
+        lesson_title, lesson_order, metadata).
+        """
+        if not rows:
+            return
+        values = prepare_detail_rows(rows)
+        if len(values) > self.COPY_THRESHOLD:
+            self._copy_rows(
+                conn,
+                "COPY ai_train_product_details (product_id, video_path, audio_path, text_path, pdf_path, lesson_title, lesson_order, metadata) FROM STDIN WITH (FORMAT csv)",
+                values
+            )
+        else:
+            cur = conn.cursor()
+            cur.executemany(_INSERT_AI_TRAIN_PRODUCT_DETAIL_SQL, values)
+
+    @with_conn
+    def insert_vector_metadata_batch(self, conn, rows: list):
+        """Insert many vector_metadata rows in a single round-trip.
+
+        Each row is (product_id, vector_index_name, content_type,
+        source_file_path, metadata).
+        """
+        if not rows:
+            return
+        values = prepare_vector_rows(rows)
+        if len(values) > self.COPY_THRESHOLD:
+            self._copy_rows(
+                conn,
+                "COPY vector_metadata (product_id, vector_index_name, content_type, source_file_path, metadata) FROM STDIN WITH (FORMAT csv)",
+                values
+            )
+        else:
+            cur = conn.cursor()
+            cur.executemany(_INSERT_VECTOR_METADATA_SQL, values)
+
+    @with_conn
+    def get_product_vectors(self, conn, product_ids: list):
+        """Get vector metadata for specific product IDs"""
+        cur = conn.cursor()
+        cur.execute(_GET_PRODUCT_VECTORS_SQL, (product_ids,))
+        return cur.fetchall()
+
+    @with_conn
+    def get_all_products(self, conn):
+        """Get all AI training products"""
+        cur = conn.cursor()
+        # Project suggestion_questions as jsonb so pg8000 hands back a decoded
+        # list and callers don't re-run json.loads per row
+        cur.execute(
+            """
+            SELECT product_id, product_name, product_category, number_of_videos,
+                   product_vector_id, suggestion_questions::jsonb, created_at
+            FROM ai_train_products
+            ORDER BY created_at DESC
+            """
+        )
+        return cur.fetchall()
+
+    # Digital Products methods
+    @staticmethod
+    def _vector_literal(embedding: list) -> str:
+        """Format an embedding as a pgvector literal, e.g. '[0.1,0.2,...]'"""
+        return '[' + ','.join(str(v) for v in embedding) + ']'
+
+    @with_conn
+    def insert_digital_product(self, conn, product_id, product_name: str, product_category: str,
+                               product_location: str, product_size_mb: float, file_format: str,
+                               description: str = None, embedding: list = None):
+        """Insert digital product details"""
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO digital_products (product_id, product_name, product_category,
+                                         product_location, product_size_mb, file_format, embedding)
+            VALUES (%s, %s, %s, %s, %s, %s, %s::vector)
+            """,
+            (product_id, product_name, product_category, product_location, product_size_mb, file_format,
+             self._vector_literal(embedding) if embedding else None)
+        )
+
+    @with_conn
+    def search_digital_products_by_embedding(self, conn, embedding: list, limit: int):
+        """ANN search over digital product embeddings via pgvector cosine distance"""
+        cur = conn.cursor()
+        query_vector = self._vector_literal(embedding)
+        cur.execute(
+            """
+            SELECT dp.product_id, dp.product_name, dp.product_category, dp.product_location,
+                   dp.product_size_mb, dp.file_format, p.price,
+                   1 - (dp.embedding <=> %s::vector) AS similarity_score
+            FROM digital_products dp
+            JOIN products p ON dp.product_id = p.product_id
+            WHERE dp.embedding IS NOT NULL
+            ORDER BY dp.embedding <=> %s::vector
+            LIMIT %s
+            """,
+            (query_vector, query_vector, limit)
+        )
+        return cur.fetchall()
+
+    @with_conn
+    def get_all_digital_products(self, conn):
+        """Get all digital products"""
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT dp.product_id, dp.product_name, dp.product_category, dp.product_location,
+                   dp.product_size_mb, dp.file_format, dp.created_at, p.price
+            FROM digital_products dp
+            JOIN products p ON dp.product_id = p.product_id
+            ORDER BY dp.created_at DESC
+            """
+        )
+        return cur.fetchall()
+
+    @with_conn
+    def get_digital_product_by_id(self, conn, product_id):
+        """Get digital product by ID"""
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT dp.product_id, dp.product_name, dp.product_category, dp.product_location,
+                   dp.product_size_mb, dp.file_format, dp.created_at, p.price
+            FROM digital_products dp
+            JOIN products p ON dp.product_id = p.product_id
+            WHERE dp.product_id = %s
+            """,
+            (product_id,)
+        )
+        return cur.fetchone()
+
+    # Authentication methods
+    @with_conn
+    def resolve_user(self, conn, user_id: str):
+        """Resolve an admin id to (role, name) with one round-trip.
+
+        Replaces the sequential is_super_admin/is_sub_admin probes.
+        Returns None for unknown ids.
+        """
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT 'super_admin' AS role, name FROM SUPER_ADMINS WHERE admin_id = %s
+            UNION ALL
+            SELECT 'sub_admin', name FROM SUB_ADMINS WHERE sub_admin_id = %s
+            LIMIT 1
+            """,
+            (user_id, user_id)
+        )
+        return cur.fetchone()
+
+    @with_conn
+    def role_of(self, conn, user_id: str) -> str:
+        """Cached role lookup; empty string means not an admin."""
+        with self._role_lock:
+            role = self._role_cache.get(user_id)
+        if role is None:
+            resolved = self.resolve_user(conn, user_id)
+            role = resolved[0] if resolved else ""
+            with self._role_lock:
+                self._role_cache[user_id] = role
+        return role
+
+    @with_conn
+    def get_super_admin_by_credentials(self, conn, email: str, password: str):
+        """Get super admin by email and password (bcrypt verify via pgcrypto)"""
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT admin_id, name FROM SUPER_ADMINS WHERE email = %s AND password_hash = crypt(%s, password_hash)",
+            (email, password)
+        )
+        return cur.fetchone()
+
+    @with_conn
+    def get_sub_admin_by_credentials(self, conn, email: str, password: str):
+        """Get sub admin by email and password (bcrypt verify via pgcrypto)"""
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT sub_admin_id, name FROM SUB_ADMINS WHERE email = %s AND password_hash = crypt(%s, password_hash)",
+            (email, password)
+        )
+        return cur.fetchone()
+
+    @with_conn
+    def is_super_admin(self, conn, admin_id: str):
+        """Check if user is super admin"""
+        cur = conn.cursor()
+        cur.execute("SELECT admin_id FROM SUPER_ADMINS WHERE admin_id = %s", (admin_id,))
+        return cur.fetchone() is not None
+
+    @with_conn
+    def is_sub_admin(self, conn, admin_id: str):
+        """Check if user is sub admin"""
+        cur = conn.cursor()
+        cur.execute("SELECT sub_admin_id FROM SUB_ADMINS WHERE sub_admin_id = %s", (admin_id,))
+        return cur.fetchone() is not None
+
+    @with_conn
+    def insert_super_admin(self, conn, name: str, email: str, password: str, phone: str = None):
+        """Insert new super admin"""
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO SUPER_ADMINS (name, email, password_hash, phone)
+            VALUES (%s, %s, crypt(%s, gen_salt('bf', 12)), %s)
+            RETURNING admin_id
+        """, (name, email, password, phone))
+        admin_id = cur.fetchone()[0]
+        # Drop any cached negative lookup for the new id
+        with self._role_lock:
+            self._role_cache.pop(str(admin_id), None)
+        return admin_id
+
+    @with_conn
+    def insert_sub_admin(self, conn, name: str, created_by_super_admin_id: str, email: str, phone_number: str, password: str):
+        """Insert new sub admin"""
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO SUB_ADMINS (name, created_by_super_admin_id, email, phone_number, password_hash)
+            VALUES (%s, %s, %s, %s, crypt(%s, gen_salt('bf', 12)))
+            RETURNING sub_admin_id
+        """, (name, created_by_super_admin_id, email, phone_number, password))
+        sub_admin_id = cur.fetchone()[0]
+        with self._role_lock:
+            self._role_cache.pop(str(sub_admin_id), None)
+        return sub_admin_id
+
+    @with_conn
+    def get_table_data(self, conn, table_name: str, batch_size: int = 1000):
+        """Get all data from specified table.
+
+        Reads through a server-side cursor in fixed-size batches so the driver
+        never buffers the whole table at once; we run inside the request
+        transaction, which DECLARE requires.
+        """
+        if table_name not in _ALLOWED_TABLE_NAMES:
+            raise ValueError(f"Table not allowed: {table_name}")
+        cur = conn.cursor()
+        cur.execute(f"DECLARE table_dump NO SCROLL CURSOR FOR SELECT * FROM {table_name}")
+        try:
+            columns = None
+            data = []
+            while True:
+                cur.execute(f"FETCH {batch_size} FROM table_dump")
+                batch = cur.fetchall()
+                if columns is None:
+                    columns = tuple(desc[0] for desc in cur.description)
+                if not batch:
+                    break
+                data.extend(dict(zip(columns, row)) for row in batch)
+            return data
+        finally:
+            cur.execute("CLOSE table_dump")
@@ -1,26 +1,116 @@
 import os
+import asyncio
+import hashlib
+import logging
+import threading
+from functools import lru_cache
 from typing import Optional
+from cachetools import TTLCache
 from google.cloud import storage, speech
 from google.cloud import aiplatform
+from google.oauth2 import service_account
 import google.generativeai as genai
 
+log = logging.getLogger("gcp_clients")
+
+# Keep gRPC channels alive through idle periods so intermediate load balancers
+# don't silently close them between requests
+_GRPC_KEEPALIVE_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+
+# Module-level lazy singletons: clients carry gRPC channels and TLS state, so
+# they are built once per process even if GCPClients is instantiated again
+@lru_cache(maxsize=1)
+def _shared_credentials():
+    service_account_path = os.getenv("GCP_SERVICE_ACCOUNT_JSON") or os.getenv("GCP_SERVICE_ACCOUNT_PATH")
+    if service_account_path and os.path.isfile(service_account_path):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account_path
+        return service_account.Credentials.from_service_account_file(service_account_path)
+    return None
+
+
+@lru_cache(maxsize=1)
+def _storage_client(project_id):
+    client = storage.Client(project=project_id, credentials=_shared_credentials())
+    try:
+        # Widen the underlying HTTP connection pool so parallel uploads from
+        # the thread pools reuse warm TLS connections instead of paying a
+        # handshake per blob
+        import requests.adapters
+        adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=32)
+        client._http.mount("https://", adapter)
+    except Exception:
+        pass
+    return client
+
+
+@lru_cache(maxsize=1)
+def _speech_client():
+    transport_cls = speech.SpeechClient.get_transport_class("grpc")
+    channel = transport_cls.create_channel(
+        credentials=_shared_credentials(),
+        options=_GRPC_KEEPALIVE_OPTIONS,
+    )
+    return speech.SpeechClient(transport=transport_cls(channel=channel))
+
+
+@lru_cache(maxsize=1)
+def _gemini_model():
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel("gemini-1.5-flash")
+
 class GCPClients:
     def __init__(self):
         self.project_id = os.getenv("GCP_PROJECT_ID")
         self.location = os.getenv("GCP_LOCATION", "us-central1")
         self.bucket_name = os.getenv("GCP_BUCKET_NAME")
-        service_account = os.getenv("GCP_SERVICE_ACCOUNT_JSON") or os.getenv("GCP_SERVICE_ACCOUNT_PATH")
-        if service_account and os.path.isfile(service_account):
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account
-        # Init clients
-        aiplatform.init(project=self.project_id, location=self.location)
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.storage_client = storage.Client()
+        # Parse the service account file once and share the credential object,
+        # instead of every client re-reading the JSON lazily
+        self._credentials = _shared_credentials()
+        # Init clients (the heavy ones come from the module-level singletons)
+        aiplatform.init(project=self.project_id, location=self.location, credentials=self._credentials)
+        self.storage_client = _storage_client(self.project_id)
         self.bucket = self.storage_client.bucket(self.bucket_name)
-        self.speech_client = speech.SpeechClient()
-        self.gemini_model = genai.GenerativeModel("gemini-1.5-flash")
+        self.speech_client = _speech_client()
+        self.gemini_model = _gemini_model()
+        # Resolved index display_name -> resource_name with a short TTL, so
+        # repeated product uploads/searches don't re-list indexes against the
+        # GCP metadata API but index recreation is picked up within minutes
+        self._index_cache = TTLCache(maxsize=16, ttl=300)
+        # Endpoint handles are reused across searches; keyed by resource name
+        self._endpoint_cache = {}
+        # Recent query embeddings keyed by SHA-256 of the text; repeated
+        # searches for the same question skip the embedding call entirely
+        self._embed_cache = TTLCache(maxsize=10000, ttl=3600)
+        self._embed_cache_lock = threading.Lock()
+        self._embed_model = None
 
     def ensure_index(self, display_name: str) -> str:
+        cached = self._index_cache.get(display_name)
+        if cached:
+            return cached
+        resource_name = self._resolve_index(display_name)
+        self._index_cache[display_name] = resource_name
+        return resource_name
+
+    def _get_endpoint(self, endpoint_name: str):
+        from google.cloud.aiplatform import MatchingEngineIndexEndpoint
+        endpoint = self._endpoint_cache.get(endpoint_name)
+        if endpoint is None:
+            endpoint = MatchingEngineIndexEndpoint(endpoint_name)
+            self._endpoint_cache[endpoint_name] = endpoint
+        return endpoint
+
+    def _invalidate_index_caches(self):
+        """Drop cached index/endpoint handles, e.g. after a NotFound."""
+        self._index_cache.clear()
+        self._endpoint_cache.clear()
+
+    def _resolve_index(self, display_name: str) -> str:
         from google.cloud.aiplatform import MatchingEngineIndex
         # Always use existing index - don't create new ones
         try:
@@ -73,13 +163,10 @@ class GCPClients:
             )
 
             op = client.update_index(request=request)
+            # The rebuild runs server-side for minutes; don't block on
+            # op.result() - the operation name is enough to track it
             print(f"Index update operation started: {op.operation.name}")
 
-            # Wait for completion
-            print("Waiting for index update to complete...")
-            result = op.result()
-            print(f"Index update completed successfully")
-
             return op
 
         except Exception as e:
@@ -91,16 +178,43 @@ class GCPClients:
     async def search_vectors(self, query_embedding: list, product_ids: list, top_k: int = 5):
         """Search for nearest neighbors in the vector index filtered by product IDs"""
         try:
-            from google.cloud.aiplatform import MatchingEngineIndex, MatchingEngineIndexEndpoint
-            
-            # Get the index
-            index_name = self.ensure_index("ai_product_index")
-            index = MatchingEngineIndex(index_name)
-            
-            # For now, return mock results since we need deployed endpoints for actual search
-            # This would need a deployed endpoint in production
-            print(f"Searching in index {index_name} for {len(product_ids)} products with top_k={top_k}")
-            
+            from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
+
+            # Get the index name (resolution may hit the metadata API; keep it
+            # off the event loop). find_neighbors goes through the endpoint
+            # handle, so there's no need to construct an index resource here.
+            index_name = await asyncio.to_thread(self.ensure_index, "ai_product_index")
+
+            # Pre-filter inside the index instead of post-filtering the result
+            # set - post-filtering collapses ANN recall for narrow product lists
+            restricts = [Namespace("product_id", allow_tokens=[str(pid) for pid in product_ids])]
+
+            endpoint_name = os.getenv("GCP_INDEX_ENDPOINT")
+            if endpoint_name:
+                endpoint = self._get_endpoint(endpoint_name)
+                # find_neighbors is a blocking gRPC call; run it in a thread so
+                # the event loop keeps serving other requests while it's in flight
+                response = await asyncio.to_thread(
+                    endpoint.find_neighbors,
+                    deployed_index_id=os.getenv("GCP_DEPLOYED_INDEX_ID", "ai_product_index"),
+                    queries=[query_embedding],
+                    num_neighbors=top_k,
+                    filter=restricts,
+                )
+                results = []
+                for neighbor in (response[0] if response else []):
+                    results.append({
+                        "id": neighbor.id,
+                        "distance": neighbor.distance,
+                        "metadata": {},
+                    })
+                return results
+
+            # No deployed endpoint configured - fall back to mock results
+            # (yield once so the mock path doesn't hog the loop either)
+            await asyncio.sleep(0)
+            log.info(f"Searching in index {index_name} for {len(product_ids)} products with top_k={top_k}")
+
             # Mock search results for development
             mock_results = []
             for i in range(min(top_k, 3)):
@@ -117,55 +231,198 @@ class GCPClients:
             return mock_results
             
         except Exception as e:
-            print(f"Error in vector search: {e}")
+            from google.api_core.exceptions import NotFound
+            if isinstance(e, NotFound):
+                # Index or endpoint was recreated; drop stale handles so the
+                # next search re-resolves instead of failing for the cache TTL
+                self._invalidate_index_caches()
+            log.error(f"Error in vector search: {e}")
             return []
 
+    def _get_embed_model(self):
+        if self._embed_model is None:
+            from vertexai.language_models import TextEmbeddingModel
+            self._embed_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
+        return self._embed_model
+
+    # Max inputs per Vertex get_embeddings request
+    EMBED_SUB_BATCH = 64
+
+    async def embed_batch(self, texts: list):
+        """Generate embeddings for a batch of texts.
+
+        Cache hits are served from the in-process TTL cache; the remaining
+        texts go to Vertex in get_embeddings calls of at most
+        EMBED_SUB_BATCH inputs, falling back to the mock embedding when
+        credentials aren't configured.
+        """
+        results = [None] * len(texts)
+        pending = []  # (position, text)
+        with self._embed_cache_lock:
+            for i, text in enumerate(texts):
+                cached = self._embed_cache.get(hashlib.sha256(text.encode()).digest())
+                if cached is not None:
+                    results[i] = cached
+                else:
+                    pending.append((i, text))
+        if pending:
+            embeddings = None
+            if self._credentials is not None:
+                try:
+                    batch = [text for _, text in pending]
+                    model = self._get_embed_model()
+                    embeddings = []
+                    # Vertex caps inputs per request; sub-batch large page
+                    # sets instead of failing the whole call
+                    for start in range(0, len(batch), self.EMBED_SUB_BATCH):
+                        sub = batch[start:start + self.EMBED_SUB_BATCH]
+                        response = await asyncio.to_thread(model.get_embeddings, sub)
+                        embeddings.extend(e.values for e in response)
+                except Exception as e:
+                    embeddings = None
+                    log.warning(f"Vertex embedding call failed, using mock embeddings: {e}")
+            if embeddings is None:
+                embeddings = [await self.embed_query(text) for _, text in pending]
+            with self._embed_cache_lock:
+                for (i, text), embedding in zip(pending, embeddings):
+                    results[i] = embedding
+                    self._embed_cache[hashlib.sha256(text.encode()).digest()] = embedding
+        return results
+
     async def embed_query(self, query_text: str):
         """Generate embedding for search query"""
         try:
-            # For now, use the same mock embedding as in pipeline
+            # For now, use the same mock embedding as in pipeline. Tiling the
+            # MD5 digest and dividing in NumPy replaces the old 768-iteration
+            # Python loop with one vectorized operation.
             import hashlib
-            text_hash = hashlib.md5(query_text.encode()).hexdigest()
-            
-            embedding = []
-            for i in range(768):
-                hash_part = text_hash[(i * 2) % len(text_hash): (i * 2 + 2) % len(text_hash)]
-                if len(hash_part) == 2:
-                    value = int(hash_part, 16) / 255.0
-                else:
-                    value = 0.5
-                embedding.append(value)
-            
-            print(f"Generated query embedding with {len(embedding)} dimensions")
+            import numpy as np
+            # Deterministic seed only, so skip the FIPS-gated md5 path
+            digest = hashlib.md5(query_text.encode(), usedforsecurity=False).digest()
+            buf = np.frombuffer((digest * ((768 // len(digest)) + 1))[:768], dtype=np.uint8)
+            embedding = (buf.astype(np.float32) / 255.0).tolist()
+
+            log.debug(f"Generated query embedding with {len(embedding)} dimensions")
             return embedding
-            
+
         except Exception as e:
-            print(f"Error generating query embedding: {e}")
+            log.error(f"Error generating query embedding: {e}")
             return []
 
+    # Resumable upload chunk size; also used for the parallel chunked path
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    # Files above this size go through the parallel chunked upload path
+    LARGE_UPLOAD_THRESHOLD = 100 * 1024 * 1024
+
     def upload_file_to_gcs(self, file_content: bytes, destination_path: str, content_type: str = None):
         """Upload a file to Google Cloud Storage"""
         try:
             blob = self.bucket.blob(destination_path)
+            if content_type is None:
+                import mimetypes
+                content_type, _ = mimetypes.guess_type(destination_path)
             if content_type:
                 blob.content_type = content_type
-            blob.upload_from_string(file_content)
+            if len(file_content) > self.LARGE_UPLOAD_THRESHOLD:
+                # Large files (e.g. training videos): upload chunks in parallel
+                # for 2-5x better throughput than a single stream
+                import tempfile
+                from google.cloud.storage import transfer_manager
+                with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                    tmp.write(file_content)
+                    tmp_path = tmp.name
+                try:
+                    transfer_manager.upload_chunks_concurrently(
+                        tmp_path,
+                        blob,
+                        chunk_size=self.UPLOAD_CHUNK_SIZE,
+                        max_workers=8,
+                    )
+                finally:
+                    try:
+                        os.remove(tmp_path)
+                    except Exception:
+                        pass
+            elif len(file_content) > self.UPLOAD_CHUNK_SIZE:
+                # Mid-size files: resumable upload in 8 MB chunks so a dropped
+                # connection retries the current chunk, not the whole object
+                import io
+                blob.chunk_size = self.UPLOAD_CHUNK_SIZE
+                blob.upload_from_file(io.BytesIO(file_content), content_type=content_type)
+            else:
+                blob.upload_from_string(file_content)
             gcs_uri = f"gs://{self.bucket_name}/{destination_path}"
-            print(f"Uploaded file to {gcs_uri}")
+            log.info(f"Uploaded file to {gcs_uri}")
             return gcs_uri
         except Exception as e:
-            print(f"Error uploading file to GCS: {e}")
+            log.error(f"Error uploading file to GCS: {e}")
+            raise
+
+    def upload_stream_to_gcs(self, file_like, destination_path: str, content_type: str = None, size: int = None):
+        """Stream a file-like object to GCS without buffering it in memory"""
+        try:
+            blob = self.bucket.blob(destination_path)
+            blob.upload_from_file(file_like, content_type=content_type, size=size, rewind=True, timeout=300)
+            gcs_uri = f"gs://{self.bucket_name}/{destination_path}"
+            log.info(f"Uploaded file to {gcs_uri}")
+            return gcs_uri
+        except Exception as e:
+            log.error(f"Error streaming file to GCS: {e}")
             raise
 
     def create_product_folder(self, product_name: str, product_type: str = "digital_products"):
-        """Create a folder structure in GCS for a product"""
-        # Clean product name for folder path
+        """Compute the GCS folder path for a product.
+
+        GCS has no real folders - the "folder" exists once the first object is
+        uploaded under the prefix, so no placeholder blob is written here.
+        """
         clean_name = product_name.replace(" ", "_").replace("/", "_")
         folder_path = f"{product_type}/{clean_name}/"
-        
-        # Create a placeholder file to ensure folder exists
-        placeholder_blob = self.bucket.blob(f"{folder_path}.placeholder")
-        placeholder_blob.upload_from_string("")
-        
-        print(f"Created product folder: {folder_path}")
         return folder_path
+
+    def product_folder_exists(self, folder_path: str) -> bool:
+        """Check whether any object exists under a product folder prefix."""
+        blobs = self.storage_client.list_blobs(self.bucket_name, prefix=folder_path, max_results=1)
+        return next(iter(blobs), None) is not None
+
+class EmbedBatcher:
+    """Coalesce concurrent embedding requests into batched calls.
+
+    Queries arriving within a short flush window share one embed_batch call
+    instead of paying one embedding RPC each.
+    """
+    def __init__(self, clients: GCPClients, flush_ms: int = 8, max_batch: int = 64):
+        self.clients = clients
+        self.flush_ms = flush_ms
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    async def submit(self, text: str):
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                # Let nearby requests pile up, then drain up to max_batch
+                await asyncio.sleep(self.flush_ms / 1000)
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                embeddings = await self.clients.embed_batch([text for text, _ in batch])
+                for (_, future), embedding in zip(batch, embeddings):
+                    if not future.done():
+                        future.set_result(embedding)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,30 @@
+-- Indexes for the hot query paths.
+--
+-- ux_product_types_name also backs the ON CONFLICT (type_name) upsert used by
+-- product creation. The (product_id, created_at) key on vector_metadata
+-- matches get_product_vectors' ANY() filter and per-product ordering, and the
+-- created_at index serves the ORDER BY created_at DESC listing without a sort.
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_types_name ON product_types (type_name);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_super_admins_email ON super_admins (email);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sub_admins_email ON sub_admins (email);
+
+CREATE INDEX IF NOT EXISTS ix_vector_metadata_pid_created
+    ON vector_metadata (product_id, created_at);
+
+CREATE INDEX IF NOT EXISTS ix_ai_train_products_created
+    ON ai_train_products (created_at DESC);
+
+CREATE INDEX IF NOT EXISTS ix_digital_products_created
+    ON digital_products (created_at DESC);
+
+-- ANN index for search_digital_products_by_embedding's cosine-distance
+-- ORDER BY. The pgvector extension and embedding column have to exist before
+-- the hnsw index can be built (768 dims = text-embedding-004 output).
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE digital_products ADD COLUMN IF NOT EXISTS embedding vector(768);
+
+CREATE INDEX IF NOT EXISTS ix_digital_products_embedding
+    ON digital_products USING hnsw (embedding vector_cosine_ops);
@@ -0,0 +1,21 @@
+-- Move admin passwords to bcrypt hashes verified in Postgres via pgcrypto.
+--
+-- Login queries compare with crypt(%s, password_hash) = password_hash, so the
+-- constant-time bcrypt verify runs in pgcrypto's C code in one round-trip and
+-- no plaintext passwords remain at rest.
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE super_admins ADD COLUMN IF NOT EXISTS password_hash text;
+ALTER TABLE sub_admins ADD COLUMN IF NOT EXISTS password_hash text;
+
+UPDATE super_admins
+SET password_hash = crypt(password, gen_salt('bf', 12))
+WHERE password_hash IS NULL AND password IS NOT NULL;
+
+UPDATE sub_admins
+SET password_hash = crypt(password, gen_salt('bf', 12))
+WHERE password_hash IS NULL AND password IS NOT NULL;
+
+ALTER TABLE super_admins DROP COLUMN IF EXISTS password;
+ALTER TABLE sub_admins DROP COLUMN IF EXISTS password;
@@ -0,0 +1,42 @@
+"""Row-shaping helpers for the hot DB write paths.
+
+Deliberately flat, fully annotated functions with no class state so the
+module can be compiled with mypyc (``mypyc row_prep.py``) for a native fast
+path when ingesting thousands of lessons; it runs unchanged as plain Python
+when no compiled build is present. The repo has no build step today, so the
+interpreted module is what ships.
+"""
+from typing import Any, List, Sequence, Tuple
+
+import orjson
+
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def json_value(v: Any) -> Any:
+    """Serialize dicts/lists for jsonb columns via orjson; pass through the rest.
+
+    OPT_SERIALIZE_NUMPY lets numpy arrays in metadata serialize without a
+    manual .tolist(); OPT_NON_STR_KEYS covers int-keyed dicts.
+    """
+    if isinstance(v, (dict, list)):
+        return orjson.dumps(v, option=_ORJSON_OPTS).decode()
+    return v
+
+
+def prepare_detail_rows(rows: Sequence[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+    """Shape ai_train_product_details rows for executemany/COPY.
+
+    Each row is (product_id, video_path, audio_path, text_path, pdf_path,
+    lesson_title, lesson_order, metadata); metadata is serialized in place.
+    """
+    return [row[:7] + (json_value(row[7]),) for row in rows]
+
+
+def prepare_vector_rows(rows: Sequence[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+    """Shape vector_metadata rows for executemany/COPY.
+
+    Each row is (product_id, vector_index_name, content_type,
+    source_file_path, metadata); metadata is serialized in place.
+    """
+    return [row[:4] + (json_value(row[4]),) for row in rows]